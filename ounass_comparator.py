@@ -1,9 +1,20 @@
 import streamlit as st
 import pandas as pd
+import pyarrow.parquet as pq
+import numpy as np
 import requests
-import xml.etree.ElementTree as ET
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree as ET
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from io import BytesIO
+import itertools
+import json
 import os
+import threading
+import time
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import re # For cleaning price strings
 
 # --- Configuration ---
@@ -23,166 +34,415 @@ FEEDS = {
 }
 
 SNAPSHOT_DIR = "feed_snapshots"
+SNAPSHOT_MAX_AGE = 3600 * 4 # Seconds before a snapshot is refetched (also the lifetime of the in-memory caches)
 os.makedirs(SNAPSHOT_DIR, exist_ok=True)
 
+# Shared HTTP session: all feeds live on the same host, so keep-alive connections
+# (and their TLS handshakes) are reused across feed downloads and worker threads.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                      max_retries=Retry(total=2, backoff_factor=0.3)))
+
 # XML Namespace for Google Shopping Feed tags (e.g., g:id, g:price)
 NAMESPACES = {'g': 'http://base.google.com/ns/1.0'}
+# Atom namespace, used when a feed is served as <feed><entry>...</entry></feed>
+ATOM_NS_URI = 'http://www.w3.org/2005/Atom'
+ATOM_NS = f'{{{ATOM_NS_URI}}}'
+ATOM_ENTRY_TAG = ATOM_NS + 'entry'
+# Compiled once; returns the href of an Atom entry's <link rel="alternate"> (as a list)
+_ATOM_LINK_XPATH = ET.XPath("atom:link[@rel='alternate']/@href", namespaces={'atom': ATOM_NS_URI},
+                            smart_strings=False)
+
+# Fully-qualified child tags of an item, built once so the parse loop never resolves namespace prefixes
+G_NS = f"{{{NAMESPACES['g']}}}"
+_TAGS = {
+    'id': G_NS + 'id',
+    'title': 'title', # Sample has <title> and <link> without 'g:'
+    'atom_title': ATOM_NS + 'title',
+    'link': 'link',
+    'image_link': G_NS + 'image_link',
+    'brand': G_NS + 'brand',
+    'product_type': G_NS + 'product_type',
+    'custom_label_0': G_NS + 'custom_label_0',
+    'price': G_NS + 'price',
+    'sale_price': G_NS + 'sale_price',
+}
+
+# Columns of the product table, as built by parse_xml_feed
+PRODUCT_COLUMNS = ('product_id', 'title', 'brand', 'category', 'price', 'sale_price', 'link', 'image_link')
+
+# Sequence of digits, dots, or commas inside a price string such as "AED 1,250.00"
+_PRICE_RE = re.compile(r'([\d.,]+)')
 
 # --- Helper Functions ---
 
-def clean_price(price_str):
+def clean_price_column(price_strs):
     """
-    Cleans a price string (e.g., "49300 AED" or "AED 1,250.00") and converts it to a float.
-    Returns None if the price cannot be parsed.
+    Cleans a Series of price strings (e.g., "49300 AED" or "AED 1,250.00") and converts them to floats.
+    Prices that cannot be parsed (missing, empty, or e.g. "1.2.3") become NaN.
     """
-    if not price_str: # Handles None or empty string
-        return None
-    
-    # Regex to find a sequence of digits, dots, or commas (potential price)
-    match = re.search(r'[\d\.,]+', price_str)
-    if match:
-        cleaned_price_str = match.group(0)
-        # Remove commas used as thousand separators
-        cleaned_price_str = cleaned_price_str.replace(',', '')
-        try:
-            return float(cleaned_price_str)
-        except ValueError:
-            # Failed to convert to float (e.g., if multiple dots like "1.2.3")
-            return None
-    return None # No numeric part found
-
-def parse_xml_feed(xml_content):
-    """Parses XML content and returns a list of product dictionaries."""
-    products = []
+    # Vectorised over the whole column, so no Python-level call is made per product
+    amounts = price_strs.str.extract(_PRICE_RE, expand=False)
+    # Remove commas used as thousand separators
+    amounts = amounts.str.replace(',', '', regex=False)
+    prices = pd.to_numeric(amounts, errors='coerce')
+
+    # to_numeric only understands ASCII digits, but the regex also matches other Unicode digits
+    # (e.g. Arabic-Indic "١٢٣" in the Arabic feeds); float() parses those, so convert just those values with it
+    non_ascii = prices.isna() & amounts.str.contains(r'[^\x00-\x7f]', na=False) # str.isascii needs pandas 3
+    if non_ascii.any():
+        prices = prices.astype('float64')
+        prices[non_ascii] = amounts[non_ascii].map(_to_float)
+    return prices
+
+def _to_float(amount):
+    """float() that returns NaN instead of raising for unparseable values (e.g. "1.2.3")."""
     try:
-        root = ET.fromstring(xml_content)
-        
-        # Determine the main container for items (RSS: channel, Atom: feed directly)
-        # And the tag name for items (RSS: item, Atom: entry)
-        item_elements = []
-        channel = root.find('channel') # Common for RSS-based feeds
-        if channel is not None:
-            item_elements = channel.findall('item')
+        return float(amount)
+    except ValueError:
+        return np.nan
+
+def _item_fields(item_el):
+    """Returns the text of each child tag of a feed item, keeping the first one seen per tag (like findtext)."""
+    vals = {}
+    for child in item_el: # Visit each child once instead of searching the item per field
+        vals.setdefault(child.tag, child.text or '') # findtext gives '' for an empty element
+    return vals
+
+def _append_product(cols, vals, title, link):
+    """Appends a product's fields from an item's child texts to the column lists. Items without a product ID are skipped."""
+    product_id = vals.get(_TAGS['id'])
+    if not product_id: # A product ID is essential
+        return
+
+    # Using g:product_type for category as it's standard and present in sample
+    category = vals.get(_TAGS['product_type'])
+    if not category: # Fallback to custom labels if g:product_type is missing
+        category = vals.get(_TAGS['custom_label_0'])
+
+    cols['product_id'].append(product_id)
+    cols['title'].append(title)
+    cols['brand'].append(vals.get(_TAGS['brand']))
+    cols['category'].append(category)
+    # Raw price strings; converted to numbers for the whole feed at once in load_or_fetch_feed_data
+    cols['price'].append(vals.get(_TAGS['price']))
+    cols['sale_price'].append(vals.get(_TAGS['sale_price'])) # Will be None if not on sale or empty tag (sample has it empty)
+    cols['link'].append(link)
+    cols['image_link'].append(vals.get(_TAGS['image_link']))
+
+def empty_product_columns():
+    """Returns a dict of empty lists, one per product column, in the order the columns are displayed."""
+    return {col: [] for col in PRODUCT_COLUMNS}
+
+def _release_item(item_el):
+    """Frees a processed item and the already-processed siblings still attached to its parent."""
+    item_el.clear()
+    while item_el.getprevious() is not None:
+        del item_el.getparent()[0]
+
+def _parse_rss_items(item_elements):
+    """Extracts products from RSS <item> elements, where <title> and <link> are un-namespaced."""
+    cols = empty_product_columns()
+    for item_el in item_elements:
+        vals = _item_fields(item_el)
+        _append_product(cols, vals, vals.get(_TAGS['title']), vals.get(_TAGS['link']))
+        _release_item(item_el)
+    return cols
+
+def _parse_atom_entries(entry_elements):
+    """Extracts products from Atom <entry> elements, falling back to the Atom-namespaced <title>/<link>."""
+    cols = empty_product_columns()
+    for entry_el in entry_elements:
+        vals = _item_fields(entry_el)
+
+        # We'll try generic tags first, then Atom-specific ones
+        title = vals.get(_TAGS['title'])
+        if title is None: # Atom <title> is namespaced
+            title = vals.get(_TAGS['atom_title'])
+
+        link = vals.get(_TAGS['link'])
+        if link is None: # Atom <link> can be more complex (rel="alternate")
+            hrefs = _ATOM_LINK_XPATH(entry_el)
+            if hrefs:
+                link = hrefs[0]
+
+        _append_product(cols, vals, title, link)
+        _release_item(entry_el)
+    return cols
+
+class _TailRecorder:
+    """Wraps a binary stream and remembers the last bytes read from it."""
+    def __init__(self, stream, keep=256):
+        self._stream = stream
+        self._keep = keep
+        self.tail = b''
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        if data:
+            self.tail = (self.tail + data[-self._keep:])[-self._keep:] # Slice first so the chunk is never copied whole
+        return data
+
+def _document_complete(tail, root_tag):
+    """Returns True if the raw document ends with the closing tag of its root (optionally followed by comments)."""
+    local_name = re.escape(root_tag.rpartition('}')[2].encode())
+    pattern = rb'</(?:[\w.-]+:)?' + local_name + rb'\s*>(?:\s|<!--.*?-->)*$'
+    return re.search(pattern, tail, re.S) is not None
+
+def parse_xml_feed(byte_stream):
+    """
+    Streams XML from a binary file-like object and returns the products as a dict of
+    column name -> list of values (all lists empty if nothing could be parsed).
+    """
+    try:
+        # iterparse hands us each element as soon as its closing tag is read, so only
+        # one <item>/<entry> needs to be held in memory at a time instead of the whole DOM.
+        # RSS items are un-namespaced <item> tags; Atom items are <entry> in the Atom namespace.
+        # libxml2 filters on those tags itself, so no other element reaches the Python loop.
+        # recover=True tolerates bad entities and stray '&'s, but it also closes every open tag when the body
+        # ends early, so completeness is checked against the raw bytes that were actually received.
+        byte_stream = _TailRecorder(byte_stream)
+        item_events = ET.iterparse(byte_stream, events=('end',), tag=('item', ATOM_ENTRY_TAG),
+                                   huge_tree=True, recover=True, remove_blank_text=True)
+        first_event = next(item_events, None)
+        if first_event is None:
+            return empty_product_columns()
+
+        # A feed is either RSS or Atom throughout, so the first item decides which parser handles all of them.
+        # (The root isn't available up front when streaming, so the first item stands in for it.)
+        first_item = first_event[1]
+        item_elements = itertools.chain([first_item], (item_el for _, item_el in item_events))
+        if first_item.tag == ATOM_ENTRY_TAG:
+            product_columns = _parse_atom_entries(item_elements)
         else:
-            # Check for Atom feed structure (<feed><entry>...</entry>)
-            # Atom namespace URI is 'http://www.w3.org/2005/Atom'
-            atom_ns_uri = 'http://www.w3.org/2005/Atom'
-            if root.tag.startswith(f'{{{atom_ns_uri}}}'): # Check if root is <feed> in Atom ns
-                # When parsing Atom, tags like <entry> and <title> are also in Atom namespace
-                item_elements = root.findall(f'{{{atom_ns_uri}}}entry')
-            elif root.tag == 'channel' or root.tag == 'feed': # Root itself is the channel/feed
-                item_elements = root.findall('item') or root.findall(f'{{{atom_ns_uri}}}entry')
-            else:
-                # Fallback: items might be directly under the root (less common for full feeds)
-                item_elements = root.findall('item')
-
-        for item_el in item_elements:
-            # Extract data based on the provided sample and common Google Shopping tags
-            # Use NAMESPACES for g:prefixed tags, None for non-prefixed tags.
-            
-            # For Atom feeds, some standard tags like 'title', 'link' are namespaced.
-            # We'll try generic first, then Atom-specific if needed.
-            is_atom_entry = item_el.tag.startswith(f'{{{atom_ns_uri}}}') if atom_ns_uri else False
-            atom_item_ns = { 'atom': atom_ns_uri } if is_atom_entry else None
-
-            product_id = item_el.findtext('g:id', namespaces=NAMESPACES)
-            
-            title = item_el.findtext('title') # Sample has <title> without 'g:'
-            if title is None and is_atom_entry: # Atom <title> is namespaced
-                 title = item_el.findtext('atom:title', namespaces=atom_item_ns)
-
-            link = item_el.findtext('link')   # Sample has <link> without 'g:'
-            if link is None and is_atom_entry: # Atom <link> can be more complex (rel="alternate")
-                link_element = item_el.find("atom:link[@rel='alternate']", namespaces=atom_item_ns)
-                if link_element is not None:
-                    link = link_element.get('href')
-            
-            image_link = item_el.findtext('g:image_link', namespaces=NAMESPACES)
-            brand = item_el.findtext('g:brand', namespaces=NAMESPACES)
-            
-            # Using g:product_type for category as it's standard and present in sample
-            category = item_el.findtext('g:product_type', namespaces=NAMESPACES)
-            if not category: # Fallback to custom labels if g:product_type is missing
-                category = item_el.findtext('g:custom_label_0', namespaces=NAMESPACES)
-
-            price_str = item_el.findtext('g:price', namespaces=NAMESPACES)
-            sale_price_str = item_el.findtext('g:sale_price', namespaces=NAMESPACES) # Sample has this empty
-            
-            price_numeric = clean_price(price_str)
-            sale_price_numeric = clean_price(sale_price_str)
-
-            if product_id: # A product ID is essential
-                products.append({
-                    'product_id': product_id,
-                    'title': title,
-                    'brand': brand,
-                    'category': category,
-                    'price': price_numeric,
-                    'sale_price': sale_price_numeric, # Will be None if not on sale or empty tag
-                    'link': link,
-                    'image_link': image_link
-                })
+            product_columns = _parse_rss_items(item_elements)
+
+        if not _document_complete(byte_stream.tail, item_events.root.tag):
+            # Don't let a partial feed become today's snapshot (it would show the rest of the catalogue as missing)
+            st.error(f"The feed ended before the XML document was complete (after {len(product_columns['product_id'])} products); "
+                     "the download was probably cut off.")
+            return empty_product_columns()
+        return product_columns
     except ET.ParseError as e:
         st.error(f"XML parsing error for the feed: {e}")
-        return []
+        return empty_product_columns()
     except Exception as e:
         st.error(f"An unexpected error occurred while processing XML: {e}")
-        return []
-    return products
+        return empty_product_columns()
 
-@st.cache_data(ttl=3600*4, show_spinner=False) # Cache data for 4 hours
-def load_or_fetch_feed_data(feed_key, feed_url):
-    """Loads daily snapshot or fetches and parses the feed if snapshot doesn't exist or is outdated."""
+def snapshot_path(feed_key):
+    """Returns the path of today's parquet snapshot for a feed."""
     today_str = datetime.now().strftime("%Y-%m-%d")
     # Sanitize feed_key for use in filenames
     safe_feed_key = "".join(c if c.isalnum() else "_" for c in feed_key)
-    snapshot_file = os.path.join(SNAPSHOT_DIR, f"{safe_feed_key}_{today_str}.parquet")
+    return os.path.join(SNAPSHOT_DIR, f"{safe_feed_key}_{today_str}.parquet")
+
+def snapshot_mtime(path):
+    """Returns the modification time of a snapshot file, or None if it is missing (or unreadable)."""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
 
-    if os.path.exists(snapshot_file):
+def snapshot_is_fresh(path):
+    """Returns True if the snapshot file exists and was written less than SNAPSHOT_MAX_AGE seconds ago."""
+    mtime = snapshot_mtime(path)
+    return mtime is not None and mtime >= time.time() - SNAPSHOT_MAX_AGE
+
+def feed_metadata(df):
+    """Returns the sorted brand and category lists of a feed DataFrame, as used by the sidebar filters."""
+    metadata = {}
+    for meta_key, col in (('brands', 'brand'), ('categories', 'category')):
+        if df.empty or col not in df.columns:
+            metadata[meta_key] = []
+        elif isinstance(df[col].dtype, pd.CategoricalDtype):
+            # Categories are already the sorted distinct values, no column scan needed
+            metadata[meta_key] = df[col].cat.categories.tolist()
+        else:
+            metadata[meta_key] = sorted(df[col].dropna().unique().tolist())
+    return metadata
+
+def hash_product_ids(product_ids):
+    """Returns a stable uint64 hash per product ID, so feeds can be compared as plain integer arrays."""
+    return pd.util.hash_array(product_ids.to_numpy(dtype=object))
+
+def read_snapshot(snapshot_file):
+    """Reads a snapshot file, indexed by product ID hash and with df.attrs['snapshot_mtime'] set."""
+    loaded_mtime = snapshot_mtime(snapshot_file)
+    df = pd.read_parquet(snapshot_file, memory_map=True)
+    if 'pid_hash' not in df.columns: # Snapshot written before the hash column existed
+        df['pid_hash'] = hash_product_ids(df['product_id'])
+    df = df.set_index('pid_hash')
+    df.attrs['snapshot_mtime'] = loaded_mtime
+    return df
+
+def stale_snapshot_or_empty(feed_key, snapshot_file):
+    """
+    Returns today's snapshot even if it is older than SNAPSHOT_MAX_AGE, for when refetching the feed failed,
+    or an empty DataFrame if there is no readable snapshot.
+    """
+    if snapshot_mtime(snapshot_file) is None:
+        return pd.DataFrame()
+    try:
+        df = read_snapshot(snapshot_file)
+    except Exception:
+        return pd.DataFrame()
+    snapshot_time = datetime.fromtimestamp(df.attrs['snapshot_mtime']).strftime('%H:%M')
+    st.warning(f"Showing the snapshot of {feed_key} from {snapshot_time} because the feed could not be refetched.")
+    return df
+
+@st.cache_data(ttl=SNAPSHOT_MAX_AGE, show_spinner=False, max_entries=len(FEEDS)) # One entry per feed
+def load_or_fetch_feed_data(feed_key, feed_url):
+    """
+    Loads today's snapshot or fetches and parses the feed if the snapshot doesn't exist or is older than SNAPSHOT_MAX_AGE.
+    The returned DataFrame is indexed by product ID hash (pid_hash), and df.attrs['snapshot_mtime'] records
+    which version of the snapshot file it matches (None if it couldn't be written).
+    If the refetch fails, today's older snapshot is used rather than returning no data.
+    """
+    snapshot_file = snapshot_path(feed_key)
+
+    # A single stat decides whether the snapshot is usable, before the file is ever opened
+    if snapshot_is_fresh(snapshot_file):
         try:
             # st.info(f"Loading today's snapshot for {feed_key} from {snapshot_file}...")
-            return pd.read_parquet(snapshot_file)
+            return read_snapshot(snapshot_file)
         except Exception as e:
             st.warning(f"Could not load snapshot {snapshot_file}: {e}. Refetching data.")
 
     # st.info(f"Fetching data for {feed_key} from {feed_url}...")
     try:
-        response = requests.get(feed_url, timeout=60) # 60-second timeout
-        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-        
-        # Try decoding with UTF-8, fallback to requests' auto-detected encoding
-        try:
-            xml_content = response.content.decode('utf-8')
-        except UnicodeDecodeError:
-            xml_content = response.text 
-
-        products_list = parse_xml_feed(xml_content)
-        if not products_list:
+        # stream=True leaves the body unread so the parser can consume it straight off the socket
+        with SESSION.get(feed_url, timeout=(5, 60), stream=True) as response: # 5s to connect, 60s to read
+            response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
+
+            # Undo any gzip/deflate transfer encoding while reading; the parser takes the
+            # character encoding from the XML declaration, so no decoded copy of the body is made
+            response.raw.decode_content = True
+            product_columns = parse_xml_feed(response.raw)
+        if not product_columns['product_id']:
             # parse_xml_feed will show an error if parsing fails.
             # If list is empty due to no items, show a warning.
             if not any(st.session_state.get(key, {}).get('type') == 'error' for key in st.session_state): # Avoid double message
                  st.warning(f"No products found or parsed for {feed_key}. The feed might be empty or structured differently than expected.")
-            return pd.DataFrame() # Return empty DataFrame
-
-        df = pd.DataFrame(products_list)
-        df.to_parquet(snapshot_file, index=False)
+            return stale_snapshot_or_empty(feed_key, snapshot_file)
+
+        # Built straight from per-column lists, so pandas doesn't have to transpose row dicts
+        df = pd.DataFrame(product_columns, copy=False)
+        df['pid_hash'] = hash_product_ids(df['product_id'])
+        df['price'] = clean_price_column(df['price']).astype('float32')
+        df['sale_price'] = clean_price_column(df['sale_price']).astype('float32')
+        # Brands and categories repeat across thousands of products, so store them dictionary-encoded
+        for col in ('brand', 'category'):
+            df[col] = df[col].astype('category')
+        df.to_parquet(snapshot_file, index=False, engine='pyarrow',
+                      compression='zstd', compression_level=3, use_dictionary=True)
+        # Store the filter option lists next to the snapshot so the sidebar doesn't need to scan the data
+        try:
+            with open(snapshot_file + '.meta.json', 'w', encoding='utf-8') as f:
+                json.dump(feed_metadata(df), f, ensure_ascii=False)
+        except OSError as e:
+            st.warning(f"Could not write metadata for {feed_key}: {e}")
+        # Index on the product ID hash once here, so every later lookup is a hash lookup instead of a scan
+        df = df.set_index('pid_hash')
+        df.attrs['snapshot_mtime'] = snapshot_mtime(snapshot_file)
         return df
     except requests.exceptions.RequestException as e:
         st.error(f"Could not download feed {feed_key} from {feed_url}: {e}")
-        return pd.DataFrame() # Return empty DataFrame on error
+        return stale_snapshot_or_empty(feed_key, snapshot_file)
     except Exception as e:
         st.error(f"A general error occurred while processing {feed_key} ({feed_url}): {e}")
-        return pd.DataFrame()
+        return stale_snapshot_or_empty(feed_key, snapshot_file)
+
+def load_feeds_parallel(feed_keys):
+    """Loads several feeds concurrently and returns a dict of DataFrames keyed by feed name."""
+    # Downloads are network-bound, so threads overlap the requests (the GIL is released during socket I/O).
+    # Worker threads are attached to the current script run so st.error/st.warning still reach the page.
+    ctx = get_script_run_ctx()
+
+    def _load(feed_key):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return load_or_fetch_feed_data(feed_key, FEEDS[feed_key])
+
+    with ThreadPoolExecutor(max_workers=len(feed_keys)) as executor:
+        futures = {feed_key: executor.submit(_load, feed_key) for feed_key in feed_keys}
+        return {feed_key: future.result() for feed_key, future in futures.items()}
+
+def prefetch_feed_data(feed_key, feed_url):
+    """Warms a feed's cache in the background. A failed load isn't kept, so the feed is retried (with its error shown) when selected."""
+    # Runs without a script run context, so any st.error/st.warning raised here never reaches a page
+    if load_or_fetch_feed_data(feed_key, feed_url).empty:
+        load_or_fetch_feed_data.clear(feed_key, feed_url)
+
+@st.cache_data(ttl=SNAPSHOT_MAX_AGE, show_spinner=False, max_entries=32) # Same lifetime as the feed data cache
+def load_feed_columns(feed_key, columns, version):
+    """
+    Loads only the given columns (a tuple) of a feed, indexed by product ID hash like load_or_fetch_feed_data.
+    version is the snapshot_mtime of the loaded feed data: it keys the cache, and the columns are only read
+    from disk while the snapshot file is still that version, so they always match the loaded rows.
+    """
+    snapshot_file = snapshot_path(feed_key)
+    if version is not None and snapshot_mtime(snapshot_file) == version:
+        try:
+            # Parquet is columnar, so the other columns are never read from disk
+            if 'pid_hash' in pq.read_schema(snapshot_file).names:
+                df = pd.read_parquet(snapshot_file, columns=['pid_hash', *columns], memory_map=True)
+            else: # Snapshot written before the hash column existed
+                df = pd.read_parquet(snapshot_file, columns=['product_id', *columns], memory_map=True)
+                df['pid_hash'] = hash_product_ids(df.pop('product_id'))
+            return df.set_index('pid_hash')
+        except Exception as e:
+            st.warning(f"Could not load columns from snapshot {snapshot_file}: {e}. Loading the full feed instead.")
+    df = load_or_fetch_feed_data(feed_key, FEEDS[feed_key])
+    return df[list(columns)] if not df.empty else df
 
-def get_product_details(df, product_ids_list):
-    """Retrieves product details from a DataFrame based on a list of product IDs."""
-    if df.empty or not product_ids_list:
-        return pd.DataFrame()
-    return df[df['product_id'].isin(product_ids_list)]
+@st.cache_data(ttl=SNAPSHOT_MAX_AGE, show_spinner=False, max_entries=32) # Same lifetime as the feed data cache
+def filter_feed_data(feed_key, version, brands, categories):
+    """
+    Returns the brand and category (indexed by product ID hash) of a feed's products restricted to the given
+    brands and categories (empty tuples mean no filter). Full rows are looked up later, only for the results.
+    version is the snapshot_mtime of the loaded feed data, so a refetched feed never reuses old results.
+    """
+    df = load_feed_columns(feed_key, ('brand', 'category'), version)
+    # Boolean indexing already returns a new frame, so no defensive copy is needed
+    if brands and 'brand' in df.columns:
+        df = df[df['brand'].isin(brands)]
+    if categories and 'category' in df.columns:
+        df = df[df['category'].isin(categories)]
+    return df
+
+def product_id_hashes(df):
+    """Returns the sorted, de-duplicated product ID hashes of a DataFrame (empty if the frame has none)."""
+    if df.empty or df.index.name != 'pid_hash':
+        return np.empty(0, dtype=np.uint64)
+    return np.unique(df.index.to_numpy())
+
+@st.cache_data(ttl=SNAPSHOT_MAX_AGE, show_spinner=False, max_entries=32) # Same lifetime as the feed data cache
+def get_feed_metadata(feed_key, version):
+    """
+    Returns a feed's brand and category lists from its snapshot sidecar, computing them if it is missing.
+    version is the snapshot_mtime of the loaded feed data, like for filter_feed_data: the sidecar is only used
+    while the snapshot file is still that version (it is written right after it), so the options match the rows.
+    """
+    snapshot_file = snapshot_path(feed_key)
+    meta_file = snapshot_file + '.meta.json'
+    meta_mtime = snapshot_mtime(meta_file)
+    if version is not None and snapshot_mtime(snapshot_file) == version and meta_mtime is not None and meta_mtime >= version:
+        try:
+            with open(meta_file, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            st.warning(f"Could not load metadata {meta_file}: {e}. Recomputing it from the feed data.")
+    return feed_metadata(load_or_fetch_feed_data(feed_key, FEEDS[feed_key]))
+
+def get_product_details(df, pid_hashes):
+    """Retrieves product details from a DataFrame indexed by product ID hash, based on a collection of hashes."""
+    if len(pid_hashes) == 0:
+        return df.iloc[0:0]
+    # The frames are already indexed by hash, so this is a hash lookup rather than a scan of the whole frame
+    return df.loc[df.index.intersection(pid_hashes)]
 
 def to_excel(df_dict):
     """Exports a dictionary of DataFrames to an Excel file in memory."""
-    from io import BytesIO
     output = BytesIO()
     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
         for sheet_name, df_data in df_dict.items():
@@ -191,6 +451,17 @@ def to_excel(df_dict):
     processed_data = output.getvalue()
     return processed_data
 
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_excel(sheet_name, df):
+    """Builds the Excel export for a single result table; cached so repeated downloads of the same data are free."""
+    return to_excel({sheet_name: df})
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_csv(df):
+    """Builds the CSV export for a single result table, a much cheaper alternative to Excel for long lists."""
+    # utf-8-sig adds a BOM so Excel opens Arabic titles correctly
+    return df.to_csv(index=False).encode('utf-8-sig')
+
 # --- Streamlit UI ---
 st.set_page_config(layout="wide", page_title="Ounass Assortment Comparator")
 st.title("Ounass Assortment Comparison Tool")
@@ -207,10 +478,20 @@ if selected_feed_A_key == selected_feed_B_key:
     st.stop()
 
 # Data Loading
-with st.spinner(f"Loading data for {selected_feed_A_key}..."):
-    df_A = load_or_fetch_feed_data(selected_feed_A_key, FEEDS[selected_feed_A_key])
-with st.spinner(f"Loading data for {selected_feed_B_key}..."):
-    df_B = load_or_fetch_feed_data(selected_feed_B_key, FEEDS[selected_feed_B_key])
+with st.spinner(f"Loading data for {selected_feed_A_key} and {selected_feed_B_key}..."):
+    feed_data = load_feeds_parallel([selected_feed_A_key, selected_feed_B_key])
+df_A = feed_data[selected_feed_A_key]
+df_B = feed_data[selected_feed_B_key]
+
+# On a session's first run, warm the remaining feeds in the background so switching to another
+# feed pair later hits the cache instead of blocking on a download
+if 'prefetch_started' not in st.session_state:
+    st.session_state['prefetch_started'] = True
+    prefetch_executor = ThreadPoolExecutor(max_workers=6)
+    for feed_key, feed_url in FEEDS.items():
+        if feed_key not in feed_data: # The selected pair has just been loaded
+            prefetch_executor.submit(prefetch_feed_data, feed_key, feed_url)
+    prefetch_executor.shutdown(wait=False) # Queued fetches keep running; don't block the page on them
 
 if df_A.empty and df_B.empty:
     st.error("Failed to load data for both selected feeds. Please check feed URLs or try again later.")
@@ -234,46 +515,46 @@ st.sidebar.info(f"{selected_feed_B_key}: {len(df_B)} products")
 # --- Filtering ---
 st.sidebar.header("Filters")
 
+metadata_A = get_feed_metadata(selected_feed_A_key, df_A.attrs.get('snapshot_mtime'))
+metadata_B = get_feed_metadata(selected_feed_B_key, df_B.attrs.get('snapshot_mtime'))
+
 # Brand Filter
-all_brands_A = sorted(df_A['brand'].dropna().unique().tolist()) if 'brand' in df_A.columns and not df_A.empty else []
-all_brands_B = sorted(df_B['brand'].dropna().unique().tolist()) if 'brand' in df_B.columns and not df_B.empty else []
+all_brands_A = metadata_A['brands']
+all_brands_B = metadata_B['brands']
 combined_brands = sorted(list(set(all_brands_A + all_brands_B)))
 
 selected_brands = st.sidebar.multiselect("Filter by Brand", options=combined_brands, key="brand_filter")
 
 # Category Filter
-all_categories_A = sorted(df_A['category'].dropna().unique().tolist()) if 'category' in df_A.columns and not df_A.empty else []
-all_categories_B = sorted(df_B['category'].dropna().unique().tolist()) if 'category' in df_B.columns and not df_B.empty else []
+all_categories_A = metadata_A['categories']
+all_categories_B = metadata_B['categories']
 combined_categories = sorted(list(set(all_categories_A + all_categories_B)))
 
 selected_categories = st.sidebar.multiselect("Filter by Category", options=combined_categories, key="category_filter")
 
-# Apply filters
-df_A_filtered = df_A.copy() if not df_A.empty else pd.DataFrame()
-df_B_filtered = df_B.copy() if not df_B.empty else pd.DataFrame()
-
-if selected_brands:
-    if 'brand' in df_A_filtered.columns:
-        df_A_filtered = df_A_filtered[df_A_filtered['brand'].isin(selected_brands)]
-    if 'brand' in df_B_filtered.columns:
-        df_B_filtered = df_B_filtered[df_B_filtered['brand'].isin(selected_brands)]
-
-if selected_categories:
-    if 'category' in df_A_filtered.columns:
-        df_A_filtered = df_A_filtered[df_A_filtered['category'].isin(selected_categories)]
-    if 'category' in df_B_filtered.columns:
-        df_B_filtered = df_B_filtered[df_B_filtered['category'].isin(selected_categories)]
+# Apply filters (sorted tuples keep the cache key stable regardless of selection order)
+brand_filter = tuple(sorted(selected_brands))
+category_filter = tuple(sorted(selected_categories))
+if brand_filter or category_filter:
+    df_A_filtered = filter_feed_data(selected_feed_A_key, df_A.attrs.get('snapshot_mtime'), brand_filter, category_filter)
+    df_B_filtered = filter_feed_data(selected_feed_B_key, df_B.attrs.get('snapshot_mtime'), brand_filter, category_filter)
+else:
+    # Nothing to filter: everything downstream only reads the frames, so use the loaded data as-is
+    df_A_filtered = df_A
+    df_B_filtered = df_B
 
 # --- Comparison ---
-ids_A = set(df_A_filtered['product_id']) if not df_A_filtered.empty and 'product_id' in df_A_filtered.columns else set()
-ids_B = set(df_B_filtered['product_id']) if not df_B_filtered.empty and 'product_id' in df_B_filtered.columns else set()
+# Set operations on sorted, unique integer hashes run entirely inside NumPy
+ids_A = product_id_hashes(df_A_filtered)
+ids_B = product_id_hashes(df_B_filtered)
 
-products_only_in_A_ids = list(ids_A - ids_B)
-products_only_in_B_ids = list(ids_B - ids_A)
-products_in_both_ids = list(ids_A.intersection(ids_B))
+products_only_in_A_ids = np.setdiff1d(ids_A, ids_B, assume_unique=True)
+products_only_in_B_ids = np.setdiff1d(ids_B, ids_A, assume_unique=True)
+products_in_both_ids = np.intersect1d(ids_A, ids_B, assume_unique=True)
 
-df_only_in_A = get_product_details(df_A_filtered, products_only_in_A_ids)
-df_only_in_B = get_product_details(df_B_filtered, products_only_in_B_ids)
+# The filtered frames only carry the columns needed for comparison, so take full rows from the loaded feeds
+df_only_in_A = get_product_details(df_A, products_only_in_A_ids)
+df_only_in_B = get_product_details(df_B, products_only_in_B_ids)
 
 st.subheader(f"Comparison Results: {selected_feed_A_key} vs {selected_feed_B_key}")
 filter_info = []
@@ -292,34 +573,52 @@ tab3_title = f"In Both Feeds ({len(products_in_both_ids)})"
 tab1, tab2, tab3 = st.tabs([tab1_title, tab2_title, tab3_title])
 
 with tab1:
-    st.dataframe(df_only_in_A)
+    st.dataframe(df_only_in_A, hide_index=True)
     if not df_only_in_A.empty:
-        excel_data_A = to_excel({f"Only_in_{selected_feed_A_key.replace(' ', '_')}": df_only_in_A})
+        # Exports are built lazily (only when a download is clicked), so rendering the tab stays cheap
+        st.download_button(
+            label="Download List (CSV)",
+            data=lambda: build_csv(df_only_in_A),
+            file_name=f"only_in_{selected_feed_A_key.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.csv",
+            mime="text/csv",
+            on_click="ignore",
+            key="download_csv_A"
+        )
         st.download_button(
-            label=f"Download List (Excel)",
-            data=excel_data_A,
+            label="Download List (Excel)",
+            data=lambda: build_excel(f"Only_in_{selected_feed_A_key.replace(' ', '_')}", df_only_in_A),
             file_name=f"only_in_{selected_feed_A_key.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore",
             key="download_A"
         )
 
 with tab2:
-    st.dataframe(df_only_in_B)
+    st.dataframe(df_only_in_B, hide_index=True)
     if not df_only_in_B.empty:
-        excel_data_B = to_excel({f"Only_in_{selected_feed_B_key.replace(' ', '_')}": df_only_in_B})
+        # Exports are built lazily (only when a download is clicked), so rendering the tab stays cheap
+        st.download_button(
+            label="Download List (CSV)",
+            data=lambda: build_csv(df_only_in_B),
+            file_name=f"only_in_{selected_feed_B_key.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.csv",
+            mime="text/csv",
+            on_click="ignore",
+            key="download_csv_B"
+        )
         st.download_button(
-            label=f"Download List (Excel)",
-            data=excel_data_B,
+            label="Download List (Excel)",
+            data=lambda: build_excel(f"Only_in_{selected_feed_B_key.replace(' ', '_')}", df_only_in_B),
             file_name=f"only_in_{selected_feed_B_key.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore",
             key="download_B"
         )
 
 with tab3:
     st.write(f"Total {len(products_in_both_ids)} products are present in both feeds (after filters).")
     # Optionally, display a sample or all common products
-    # if products_in_both_ids:
-    #     df_in_both = get_product_details(df_A_filtered, products_in_both_ids)
+    # if len(products_in_both_ids):
+    #     df_in_both = get_product_details(df_A, products_in_both_ids)
     #     st.dataframe(df_in_both.head(20)) # Show first 20 common products
 
 st.sidebar.markdown("---")
@@ -327,5 +626,5 @@ st.sidebar.caption("Ounass Feed Comparator v1.0")
 
 # To run this app:
 # 1. Save this code as a .py file (e.g., ounass_comparator.py).
-# 2. Ensure you have the necessary libraries: pip install streamlit pandas requests xlsxwriter pyarrow
+# 2. Ensure you have the necessary libraries: pip install streamlit pandas numpy requests lxml xlsxwriter pyarrow
 # 3. Open your terminal, navigate to the file's directory, and run: streamlit run ounass_comparator.py
\ No newline at end of file